@@ -8,34 +8,115 @@ Monetize The Internet 24/7
 import os
 import sys
 import asyncio
+import atexit
 import logging
+import logging.handlers
+import queue
 import random
+import secrets
 import sqlite3
+import threading
+import time
 import json
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, suppress
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Iterable, List, Dict, Optional, Tuple
 from dataclasses import dataclass, asdict
 import aiohttp
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, ContextTypes
 from telegram.constants import ParseMode
+from telegram.error import TelegramError
 
 # Environment variables
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHANNEL_ID = os.getenv('TELEGRAM_CHANNEL_ID')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('trendbot.log')
-    ]
-)
+# Feature flag: pick channel posts weighted by commission instead of uniformly
+WEIGHTED_OFFER_SELECTION = os.getenv('WEIGHTED_OFFER_SELECTION', '').lower() in ('1', 'true', 'yes')
+
+REFERRAL_REWARD = 5.0  # $5 reward per referral
+LEADERBOARD_LIMIT = 10  # entries shown by /leaderboard
+
+# Setup logging - records are queued and written by a background listener thread,
+# so logging from the event loop never blocks on file I/O
+_log_queue = queue.Queue(-1)
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [logging.StreamHandler(), logging.FileHandler('trendbot.log')]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+_log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)  # flush queued records on exit
+_root_logger = logging.getLogger()
+_root_logger.setLevel(logging.INFO)
+_root_logger.addHandler(logging.handlers.QueueHandler(_log_queue))
 log = logging.getLogger(__name__)
 
+# TIMESTAMP columns come back from the driver as datetime objects
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+# Parameterized SQL, kept as module constants so every call reuses the same
+# string and hits the connection's prepared-statement cache
+_Q_SAVE_OFFER = '''
+    INSERT INTO offers (title, description, category, commission, gravity, affiliate_link, platform)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+# SQLite keeps only the current best row while scanning, so this never sorts the table
+_Q_GET_RANDOM_OFFER = 'SELECT * FROM offers ORDER BY RANDOM() LIMIT 1'
+_Q_GET_OFFER = 'SELECT * FROM offers WHERE id = ?'
+_Q_OFFER_WEIGHTS = 'SELECT id, commission FROM offers ORDER BY id'
+_Q_HAS_OFFERS = 'SELECT 1 FROM offers LIMIT 1'
+_Q_STATS = '''
+    SELECT
+        (SELECT COUNT(*) FROM offers),
+        (SELECT COUNT(*) FROM posts),
+        (SELECT COUNT(*) FROM users),
+        (SELECT COUNT(*) FROM referrals)
+'''
+_Q_OFFER_TOTALS = 'SELECT COUNT(*), AVG(commission) FROM offers'
+_Q_OFFERS_BY_PLATFORM = '''
+    SELECT platform, COUNT(*) AS offers FROM offers GROUP BY platform ORDER BY offers DESC, platform
+'''
+_Q_OFFERS_BY_CATEGORY = '''
+    SELECT category, COUNT(*) AS offers FROM offers GROUP BY category ORDER BY offers DESC, category
+'''
+_Q_LOG_POST = 'INSERT INTO posts (offer_id, channel_id, message_id) VALUES (?, ?, ?)'
+# UPSERT ... RETURNING needs SQLite 3.35+
+_Q_SAVE_USER = '''
+    INSERT INTO users (user_id, username, first_name, referral_code, referred_by)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_active = CURRENT_TIMESTAMP
+    RETURNING id
+'''
+_Q_GET_USER = 'SELECT * FROM users WHERE user_id = ?'
+_Q_GET_USER_BY_CODE = 'SELECT * FROM users WHERE referral_code = ?'
+_Q_SAVE_REFERRAL = '''
+    INSERT INTO referrals (referrer_code, referred_user_id, reward_amount, status)
+    VALUES (?, ?, ?, ?)
+'''
+_Q_UPDATE_REFERRER_STATS = '''
+    UPDATE users SET
+        referral_count = referral_count + 1,
+        total_earnings = total_earnings + ?
+    WHERE id = ?
+'''
+_Q_GET_REFERRALS = 'SELECT * FROM referrals WHERE referrer_code = ? ORDER BY created_at DESC, id DESC'
+_Q_GET_REFERRALS_LIMIT = 'SELECT * FROM referrals WHERE referrer_code = ? ORDER BY created_at DESC, id DESC LIMIT ?'
+_Q_LEADERBOARD = '''
+    SELECT * FROM users
+    WHERE referral_count > 0
+    ORDER BY referral_count DESC, total_earnings DESC
+    LIMIT ?
+'''
+
 @dataclass
 class Offer:
     """Data class for offers"""
@@ -47,14 +128,8 @@ class Offer:
     gravity: Optional[float] = None
     affiliate_link: str = ""
     platform: str = ""
-    created_at: datetime = None
-    updated_at: datetime = None
-
-    def __post_init__(self):
-        if self.created_at is None:
-            self.created_at = datetime.now()
-        if self.updated_at is None:
-            self.updated_at = datetime.now()
+    created_at: Optional[datetime] = None  # filled in by the database
+    updated_at: Optional[datetime] = None
 
 @dataclass
 class User:
@@ -67,16 +142,11 @@ class User:
     referred_by: Optional[str] = None
     referral_count: int = 0
     total_earnings: float = 0.0
-    created_at: datetime = None
-    last_active: datetime = None
+    created_at: Optional[datetime] = None  # filled in by the database
+    last_active: Optional[datetime] = None
 
     def __post_init__(self):
-        if self.created_at is None:
-            self.created_at = datetime.now()
-        if self.last_active is None:
-            self.last_active = datetime.now()
         if not self.referral_code:
-            import secrets
             self.referral_code = f"LUX{secrets.token_hex(4).upper()}"
 
 @dataclass
@@ -87,292 +157,450 @@ class Referral:
     referred_user_id: int = 0
     reward_amount: float = 0.0
     status: str = "pending"  # pending, confirmed, paid
-    created_at: datetime = None
-    updated_at: datetime = None
-
-    def __post_init__(self):
-        if self.created_at is None:
-            self.created_at = datetime.now()
-        if self.updated_at is None:
-            self.updated_at = datetime.now()
+    created_at: Optional[datetime] = None  # filled in by the database
+    updated_at: Optional[datetime] = None
 
 class Database:
     """Simple database handler"""
     
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = 30.0  # seconds; bounds staleness from writers outside this process
+    
     def __init__(self, db_path: str = "trendbot.db"):
         self.db_path = db_path
+        # Offer ids with cumulative commission weights for get_weighted_offer;
+        # None means not loaded yet or invalidated by a write
+        self._offer_ids: Optional[List[int]] = None
+        self._cum_weights: List[float] = []
+        # Hot users as (cached_at, user), keyed both ways; the two caches always hold the same users
+        self._user_cache: "OrderedDict[int, Tuple[float, User]]" = OrderedDict()
+        self._code_cache: "OrderedDict[str, Tuple[float, User]]" = OrderedDict()
+        # One long-lived connection shared by all methods; writes are serialized by the lock
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None,
+                                    cached_statements=256,
+                                    detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute("PRAGMA cache_size=-64000")
+        self.conn.execute("PRAGMA mmap_size=268435456")
+        self._lock = threading.Lock()
         self.init_database()
+        self._warm_statements()
+    
+    def _warm_statements(self):
+        """Prepare the read queries once so the first real request hits the statement cache"""
+        # EXPLAIN QUERY PLAN would compile a different SQL string, so run the real
+        # statements with parameters that match no rows instead
+        for sql, params in (
+            (_Q_GET_RANDOM_OFFER, ()),
+            (_Q_GET_OFFER, (0,)),
+            (_Q_STATS, ()),
+            (_Q_LEADERBOARD, (0,)),
+            (_Q_GET_USER, (0,)),
+            (_Q_GET_USER_BY_CODE, ("",)),
+            (_Q_GET_REFERRALS, ("",)),
+            (_Q_GET_REFERRALS_LIMIT, ("", 0)),
+        ):
+            self.conn.execute(sql, params).fetchall()
+    
+    @contextmanager
+    def _transaction(self):
+        """Run a block of writes inside one explicit transaction"""
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                yield cursor
+                cursor.execute("COMMIT")
+            except BaseException:
+                # Also covers a failed COMMIT, so the shared connection never stays mid-transaction
+                if self.conn.in_transaction:
+                    cursor.execute("ROLLBACK")
+                raise
+    
+    def _cache_user(self, user: User):
+        """Store a user in both lookup caches, evicting the least recently used"""
+        entry = (time.monotonic(), user)
+        self._user_cache[user.user_id] = entry
+        self._code_cache[user.referral_code] = entry
+        while len(self._user_cache) > self.USER_CACHE_SIZE:
+            _, (_, evicted) = self._user_cache.popitem(last=False)
+            self._code_cache.pop(evicted.referral_code, None)
+        while len(self._code_cache) > self.USER_CACHE_SIZE:
+            _, (_, evicted) = self._code_cache.popitem(last=False)
+            self._user_cache.pop(evicted.user_id, None)
+    
+    def _get_cached_user(self, cache: OrderedDict, key) -> Optional[User]:
+        """Return a fresh cached user for key, dropping it once older than USER_CACHE_TTL"""
+        entry = cache.get(key)
+        if not entry:
+            return None
+        cached_at, user = entry
+        if time.monotonic() - cached_at >= self.USER_CACHE_TTL:
+            self._invalidate_user(user_id=user.user_id)
+            return None
+        cache.move_to_end(key)
+        return user
+    
+    def _invalidate_user(self, user_id: int = None, referral_code: str = None):
+        """Drop a user from both lookup caches"""
+        entry = self._user_cache.pop(user_id, None) or self._code_cache.pop(referral_code, None)
+        if entry:
+            _, cached = entry
+            self._user_cache.pop(cached.user_id, None)
+            self._code_cache.pop(cached.referral_code, None)
+    
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
     
     def init_database(self):
         """Initialize database tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create offers table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS offers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                description TEXT,
-                category TEXT,
-                commission REAL,
-                gravity REAL,
-                affiliate_link TEXT,
-                platform TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create users table for referral tracking
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER UNIQUE NOT NULL,
-                username TEXT,
-                first_name TEXT,
-                referral_code TEXT UNIQUE NOT NULL,
-                referred_by TEXT,
-                referral_count INTEGER DEFAULT 0,
-                total_earnings REAL DEFAULT 0.0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create referrals table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS referrals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                referrer_code TEXT NOT NULL,
-                referred_user_id INTEGER NOT NULL,
-                reward_amount REAL DEFAULT 0.0,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (referred_user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Create posts table for tracking
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS posts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                offer_id INTEGER,
-                posted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                channel_id TEXT,
-                message_id INTEGER,
-                FOREIGN KEY (offer_id) REFERENCES offers (id)
-            )
-        ''')
+        with self._transaction() as cursor:
+            # Create offers table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS offers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL,
+                    description TEXT,
+                    category TEXT,
+                    commission REAL,
+                    gravity REAL,
+                    affiliate_link TEXT,
+                    platform TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Create users table for referral tracking
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER UNIQUE NOT NULL,
+                    username TEXT,
+                    first_name TEXT,
+                    referral_code TEXT UNIQUE NOT NULL,
+                    referred_by TEXT,
+                    referral_count INTEGER DEFAULT 0,
+                    total_earnings REAL DEFAULT 0.0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Create referrals table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS referrals (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    referrer_code TEXT NOT NULL,
+                    referred_user_id INTEGER NOT NULL,
+                    reward_amount REAL DEFAULT 0.0,
+                    status TEXT DEFAULT 'pending',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (referred_user_id) REFERENCES users (user_id)
+                )
+            ''')
+            
+            # Create posts table for tracking
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS posts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    offer_id INTEGER,
+                    posted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    channel_id TEXT,
+                    message_id INTEGER,
+                    FOREIGN KEY (offer_id) REFERENCES offers (id)
+                )
+            ''')
+            
+            # Indexes for newest-first referral lookups (id breaks same-second ties), the leaderboard and posts
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_referrals_referrer_recent
+                ON referrals(referrer_code, created_at DESC, id DESC)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_users_leaderboard
+                ON users(referral_count DESC, total_earnings DESC)
+                WHERE referral_count > 0
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_posts_offer ON posts(offer_id)')
         
-        conn.commit()
-        conn.close()
         log.info("✅ Database initialized successfully")
     
     def save_offer(self, offer: Offer) -> int:
         """Save offer to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO offers (title, description, category, commission, gravity, affiliate_link, platform)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (offer.title, offer.description, offer.category, offer.commission, 
-              offer.gravity, offer.affiliate_link, offer.platform))
-        
-        offer_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self._transaction() as cursor:
+            cursor.execute(_Q_SAVE_OFFER, (offer.title, offer.description, offer.category, offer.commission,
+                                           offer.gravity, offer.affiliate_link, offer.platform))
+            
+            offer_id = cursor.lastrowid
+        self._offers_changed()
         return offer_id
     
-    def get_offers(self, limit: int = 10, category: str = None) -> List[Offer]:
-        """Get offers from database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        if category:
-            cursor.execute('''
-                SELECT * FROM offers WHERE category = ? ORDER BY created_at DESC LIMIT ?
-            ''', (category, limit))
-        else:
-            cursor.execute('''
-                SELECT * FROM offers ORDER BY created_at DESC LIMIT ?
-            ''', (limit,))
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        offers = []
-        for row in rows:
-            offer = Offer(
-                id=row[0], title=row[1], description=row[2], category=row[3],
-                commission=row[4], gravity=row[5], affiliate_link=row[6], platform=row[7],
-                created_at=datetime.fromisoformat(row[8]) if row[8] else datetime.now(),
-                updated_at=datetime.fromisoformat(row[9]) if row[9] else datetime.now()
-            )
-            offers.append(offer)
-        
-        return offers
+    def save_offers(self, offers: Iterable[Offer]):
+        """Save a batch of offers in a single transaction"""
+        with self._transaction() as cursor:
+            # executemany consumes the generator row by row, no intermediate list
+            cursor.executemany(_Q_SAVE_OFFER, (
+                (offer.title, offer.description, offer.category, offer.commission,
+                 offer.gravity, offer.affiliate_link, offer.platform)
+                for offer in offers
+            ))
+        self._offers_changed()
+    
+    def _offers_changed(self):
+        """Drop everything derived from the offers table"""
+        self._offer_ids = None
+    
+    def get_random_offer(self) -> Optional[Offer]:
+        """Pick one offer at random without loading the rest"""
+        row = self.conn.execute(_Q_GET_RANDOM_OFFER).fetchone()
+        return Offer(**row) if row else None
+    
+    def get_weighted_offer(self) -> Optional[Offer]:
+        """Pick an offer with probability proportional to its commission"""
+        if self._offer_ids is None:
+            offer_ids, cum_weights, total = [], [], 0.0
+            for offer_id, commission in self.conn.execute(_Q_OFFER_WEIGHTS):
+                total += max(commission or 0.0, 0.0)
+                offer_ids.append(offer_id)
+                cum_weights.append(total)
+            self._offer_ids, self._cum_weights = offer_ids, cum_weights
+        
+        if not self._cum_weights or self._cum_weights[-1] <= 0:
+            return self.get_random_offer()
+        
+        index = bisect_right(self._cum_weights, random.random() * self._cum_weights[-1])
+        row = self.conn.execute(_Q_GET_OFFER, (self._offer_ids[index],)).fetchone()
+        return Offer(**row) if row else None
+    
+    def has_offers(self) -> bool:
+        """Check whether any offer exists without loading one"""
+        return self.conn.execute(_Q_HAS_OFFERS).fetchone() is not None
+    
+    def stats(self) -> Tuple[int, int, int, int]:
+        """Count offers, posts, users and referrals in one query"""
+        return tuple(self.conn.execute(_Q_STATS).fetchone())
+    
+    def get_offer_stats(self) -> Tuple[int, float, List[Tuple[str, int]], List[Tuple[str, int]],
+                                       Optional[str], Optional[str]]:
+        """Aggregate offer statistics in SQL instead of loading every offer"""
+        # Returns (count, avg_commission, platform_counts, category_counts, top_platform,
+        # top_category); the breakdowns are (name, count) pairs sorted by count, highest first
+        cursor = self.conn.cursor()
+        count, avg_commission = cursor.execute(_Q_OFFER_TOTALS).fetchone()
+        platform_counts = [tuple(row) for row in cursor.execute(_Q_OFFERS_BY_PLATFORM)]
+        category_counts = [tuple(row) for row in cursor.execute(_Q_OFFERS_BY_CATEGORY)]
+        top_platform = platform_counts[0][0] if platform_counts else None
+        top_category = category_counts[0][0] if category_counts else None
+        return count, avg_commission or 0.0, platform_counts, category_counts, top_platform, top_category
     
     def log_post(self, offer_id: int, channel_id: str, message_id: int):
         """Log posted message"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO posts (offer_id, channel_id, message_id)
-            VALUES (?, ?, ?)
-        ''', (offer_id, channel_id, message_id))
-        
-        conn.commit()
-        conn.close()
+        with self._transaction() as cursor:
+            cursor.execute(_Q_LOG_POST, (offer_id, channel_id, message_id))
     
     def save_user(self, user: User) -> int:
         """Save or update user in database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        cursor.execute('SELECT id FROM users WHERE user_id = ?', (user.user_id,))
-        existing = cursor.fetchone()
+        with self._transaction() as cursor:
+            # Insert new user, or refresh name and activity of an existing one
+            cursor.execute(_Q_SAVE_USER, (user.user_id, user.username, user.first_name,
+                                          user.referral_code, user.referred_by))
+            user_id = cursor.fetchone()[0]
         
-        if existing:
-            # Update existing user
-            cursor.execute('''
-                UPDATE users SET username = ?, first_name = ?, last_active = ?
-                WHERE user_id = ?
-            ''', (user.username, user.first_name, datetime.now(), user.user_id))
-            user_id = existing[0]
-        else:
-            # Insert new user
-            cursor.execute('''
-                INSERT INTO users (user_id, username, first_name, referral_code, referred_by)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user.user_id, user.username, user.first_name, user.referral_code, user.referred_by))
-            user_id = cursor.lastrowid
-        
-        conn.commit()
-        conn.close()
+        self._invalidate_user(user_id=user.user_id)
         return user_id
     
     def get_user(self, user_id: int) -> Optional[User]:
         """Get user by user_id"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cached = self._get_cached_user(self._user_cache, user_id)
+        if cached:
+            return cached
+        
+        cursor = self.conn.cursor()
         
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+        cursor.execute(_Q_GET_USER, (user_id,))
         row = cursor.fetchone()
-        conn.close()
         
         if row:
-            return User(
-                id=row[0], user_id=row[1], username=row[2], first_name=row[3],
-                referral_code=row[4], referred_by=row[5], referral_count=row[6],
-                total_earnings=row[7],
-                created_at=datetime.fromisoformat(row[8]) if row[8] else datetime.now(),
-                last_active=datetime.fromisoformat(row[9]) if row[9] else datetime.now()
-            )
+            user = User(**row)
+            self._cache_user(user)
+            return user
         return None
     
     def get_user_by_referral_code(self, referral_code: str) -> Optional[User]:
         """Get user by referral code"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cached = self._get_cached_user(self._code_cache, referral_code)
+        if cached:
+            return cached
+        
+        cursor = self.conn.cursor()
         
-        cursor.execute('SELECT * FROM users WHERE referral_code = ?', (referral_code,))
+        cursor.execute(_Q_GET_USER_BY_CODE, (referral_code,))
         row = cursor.fetchone()
-        conn.close()
         
         if row:
-            return User(
-                id=row[0], user_id=row[1], username=row[2], first_name=row[3],
-                referral_code=row[4], referred_by=row[5], referral_count=row[6],
-                total_earnings=row[7],
-                created_at=datetime.fromisoformat(row[8]) if row[8] else datetime.now(),
-                last_active=datetime.fromisoformat(row[9]) if row[9] else datetime.now()
-            )
+            user = User(**row)
+            self._cache_user(user)
+            return user
         return None
     
-    def save_referral(self, referral: Referral) -> int:
-        """Save referral to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO referrals (referrer_code, referred_user_id, reward_amount, status)
-            VALUES (?, ?, ?, ?)
-        ''', (referral.referrer_code, referral.referred_user_id, referral.reward_amount, referral.status))
-        
-        referral_id = cursor.lastrowid
-        
-        # Update referrer's referral count and earnings
-        cursor.execute('''
-            UPDATE users SET 
-                referral_count = referral_count + 1,
-                total_earnings = total_earnings + ?
-            WHERE referral_code = ?
-        ''', (referral.reward_amount, referral.referrer_code))
+    def save_referral(self, referral: Referral, referrer_id: int) -> int:
+        """Save referral to database and credit the referrer (by users.id)"""
+        with self._transaction() as cursor:
+            cursor.execute(_Q_SAVE_REFERRAL, (referral.referrer_code, referral.referred_user_id, referral.reward_amount, referral.status))
+            
+            referral_id = cursor.lastrowid
+            
+            # Update referrer's referral count and earnings
+            cursor.execute(_Q_UPDATE_REFERRER_STATS, (referral.reward_amount, referrer_id))
         
-        conn.commit()
-        conn.close()
+        self._invalidate_user(referral_code=referral.referrer_code)
         return referral_id
     
-    def get_referrals(self, referrer_code: str) -> List[Referral]:
-        """Get referrals for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM referrals WHERE referrer_code = ? ORDER BY created_at DESC
-        ''', (referrer_code,))
-        
-        rows = cursor.fetchall()
-        conn.close()
+    def get_referrals(self, referrer_code: str, limit: Optional[int] = None) -> List[Referral]:
+        """Get referrals for a user, newest first (optionally only the latest `limit`)"""
+        cursor = self.conn.cursor()
         
-        referrals = []
-        for row in rows:
-            referral = Referral(
-                id=row[0], referrer_code=row[1], referred_user_id=row[2],
-                reward_amount=row[3], status=row[4],
-                created_at=datetime.fromisoformat(row[5]) if row[5] else datetime.now(),
-                updated_at=datetime.fromisoformat(row[6]) if row[6] else datetime.now()
-            )
-            referrals.append(referral)
+        if limit is None:
+            cursor.execute(_Q_GET_REFERRALS, (referrer_code,))
+        else:
+            cursor.execute(_Q_GET_REFERRALS_LIMIT, (referrer_code, limit))
         
-        return referrals
+        return [Referral(**row) for row in cursor.fetchall()]
     
     def get_leaderboard(self, limit: int = 10) -> List[User]:
         """Get top referrers leaderboard"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self.conn.cursor()
         
-        cursor.execute('''
-            SELECT * FROM users 
-            WHERE referral_count > 0 
-            ORDER BY referral_count DESC, total_earnings DESC 
-            LIMIT ?
-        ''', (limit,))
+        cursor.execute(_Q_LEADERBOARD, (limit,))
         
-        rows = cursor.fetchall()
-        conn.close()
-        
-        users = []
-        for row in rows:
-            user = User(
-                id=row[0], user_id=row[1], username=row[2], first_name=row[3],
-                referral_code=row[4], referred_by=row[5], referral_count=row[6],
-                total_earnings=row[7],
-                created_at=datetime.fromisoformat(row[8]) if row[8] else datetime.now(),
-                last_active=datetime.fromisoformat(row[9]) if row[9] else datetime.now()
-            )
-            users.append(user)
-        
-        return users
+        return [User(**row) for row in cursor.fetchall()]
 
 class OfferGenerator:
     """Generate realistic offers for all platforms"""
     
+    _OFFER_TEMPLATES = (
+        # ClickBank Offers
+        {
+            "title": "AI Content Creator Pro",
+            "description": "Revolutionary AI tool that creates viral content in seconds. Perfect for social media managers and content creators looking to scale their output.",
+            "category": "ai_tools",
+            "commission_range": (25, 97),
+            "platform": "ClickBank",
+            "gravity_range": (15, 85)
+        },
+        {
+            "title": "Passive Income Blueprint 2025",
+            "description": "Step-by-step system to build multiple passive income streams. Over 10,000 success stories from ordinary people making extraordinary money.",
+            "category": "make_money",
+            "commission_range": (47, 197),
+            "platform": "ClickBank",
+            "gravity_range": (20, 75)
+        },
+        {
+            "title": "Crypto Trading Mastery",
+            "description": "Professional crypto trading course that turned beginners into profitable traders. Includes live trading sessions and private Discord.",
+            "category": "crypto_airdrops",
+            "commission_range": (97, 297),
+            "platform": "ClickBank",
+            "gravity_range": (25, 90)
+        },
+        
+        # Digistore24 Offers
+        {
+            "title": "Smart Home Revolution Kit",
+            "description": "Complete smart home automation system with AI-powered controls. Transform your home into a futuristic living space.",
+            "category": "gadgets",
+            "commission_range": (15, 45),
+            "platform": "Digistore24",
+            "gravity_range": (10, 60)
+        },
+        {
+            "title": "AI Business Automation Suite",
+            "description": "All-in-one AI toolkit for automating your business operations. Includes chatbots, email automation, and customer service AI.",
+            "category": "ai_tools",
+            "commission_range": (67, 167),
+            "platform": "Digistore24",
+            "gravity_range": (30, 80)
+        },
+        {
+            "title": "Digital Nomad Lifestyle Guide",
+            "description": "Complete guide to building a location-independent business. Includes templates, tools, and step-by-step action plans.",
+            "category": "make_money",
+            "commission_range": (27, 87),
+            "platform": "Digistore24",
+            "gravity_range": (15, 70)
+        },
+        
+        # SparkLoop Newsletter Offers
+        {
+            "title": "Crypto Millionaire Newsletter",
+            "description": "Exclusive newsletter revealing crypto secrets that made ordinary people millionaires. Limited time access to insider strategies.",
+            "category": "crypto_airdrops", 
+            "commission_range": (3, 7),
+            "platform": "SparkLoop",
+            "gravity_range": (40, 95)
+        },
+        {
+            "title": "AI Weekly Insider",
+            "description": "Weekly newsletter covering the latest AI tools, trends, and money-making opportunities. Join 50,000+ subscribers.",
+            "category": "ai_tools",
+            "commission_range": (2, 6),
+            "platform": "SparkLoop",
+            "gravity_range": (35, 85)
+        },
+        {
+            "title": "Side Hustle Success Stories",
+            "description": "Weekly newsletter featuring real people making $1,000-$10,000+ monthly from side hustles. Includes actionable tips and strategies.",
+            "category": "make_money",
+            "commission_range": (4, 8),
+            "platform": "SparkLoop",
+            "gravity_range": (45, 90)
+        },
+        
+        # beehiiv Newsletter Offers
+        {
+            "title": "The Entrepreneur's Edge",
+            "description": "Daily newsletter with business insights from top entrepreneurs. Join 75,000+ subscribers getting exclusive content.",
+            "category": "newsletters",
+            "commission_range": (2, 5),
+            "platform": "beehiiv",
+            "gravity_range": (50, 95)
+        },
+        {
+            "title": "Tech Trends Weekly",
+            "description": "Weekly roundup of the hottest tech trends, gadgets, and innovations. Perfect for tech enthusiasts and early adopters.",
+            "category": "gadgets",
+            "commission_range": (1.5, 4),
+            "platform": "beehiiv",
+            "gravity_range": (30, 80)
+        },
+        {
+            "title": "Morning Crypto Brief",
+            "description": "Daily crypto market analysis and opportunities. Get the edge with insider insights and market predictions.",
+            "category": "crypto_airdrops",
+            "commission_range": (3, 6),
+            "platform": "beehiiv",
+            "gravity_range": (40, 85)
+        }
+    )
+    
+    # Title variations depend only on the template, so build them once
+    _OFFER_POOL = tuple(
+        (template, (
+            template["title"],
+            f"{template['title']} - Limited Time",
+            f"🔥 {template['title']}",
+            f"{template['title']} 2025 Edition"
+        ))
+        for template in _OFFER_TEMPLATES
+    )
+    
     def __init__(self):
         self.categories = ["make_money", "ai_tools", "crypto_airdrops", "newsletters", "gadgets"]
         self.platforms = ["ClickBank", "Digistore24", "SparkLoop", "beehiiv"]
@@ -381,125 +609,11 @@ class OfferGenerator:
         """Generate realistic offers"""
         offers = []
         
-        offer_templates = [
-            # ClickBank Offers
-            {
-                "title": "AI Content Creator Pro",
-                "description": "Revolutionary AI tool that creates viral content in seconds. Perfect for social media managers and content creators looking to scale their output.",
-                "category": "ai_tools",
-                "commission_range": (25, 97),
-                "platform": "ClickBank",
-                "gravity_range": (15, 85)
-            },
-            {
-                "title": "Passive Income Blueprint 2025",
-                "description": "Step-by-step system to build multiple passive income streams. Over 10,000 success stories from ordinary people making extraordinary money.",
-                "category": "make_money",
-                "commission_range": (47, 197),
-                "platform": "ClickBank",
-                "gravity_range": (20, 75)
-            },
-            {
-                "title": "Crypto Trading Mastery",
-                "description": "Professional crypto trading course that turned beginners into profitable traders. Includes live trading sessions and private Discord.",
-                "category": "crypto_airdrops",
-                "commission_range": (97, 297),
-                "platform": "ClickBank",
-                "gravity_range": (25, 90)
-            },
-            
-            # Digistore24 Offers
-            {
-                "title": "Smart Home Revolution Kit",
-                "description": "Complete smart home automation system with AI-powered controls. Transform your home into a futuristic living space.",
-                "category": "gadgets",
-                "commission_range": (15, 45),
-                "platform": "Digistore24",
-                "gravity_range": (10, 60)
-            },
-            {
-                "title": "AI Business Automation Suite",
-                "description": "All-in-one AI toolkit for automating your business operations. Includes chatbots, email automation, and customer service AI.",
-                "category": "ai_tools",
-                "commission_range": (67, 167),
-                "platform": "Digistore24",
-                "gravity_range": (30, 80)
-            },
-            {
-                "title": "Digital Nomad Lifestyle Guide",
-                "description": "Complete guide to building a location-independent business. Includes templates, tools, and step-by-step action plans.",
-                "category": "make_money",
-                "commission_range": (27, 87),
-                "platform": "Digistore24",
-                "gravity_range": (15, 70)
-            },
-            
-            # SparkLoop Newsletter Offers
-            {
-                "title": "Crypto Millionaire Newsletter",
-                "description": "Exclusive newsletter revealing crypto secrets that made ordinary people millionaires. Limited time access to insider strategies.",
-                "category": "crypto_airdrops", 
-                "commission_range": (3, 7),
-                "platform": "SparkLoop",
-                "gravity_range": (40, 95)
-            },
-            {
-                "title": "AI Weekly Insider",
-                "description": "Weekly newsletter covering the latest AI tools, trends, and money-making opportunities. Join 50,000+ subscribers.",
-                "category": "ai_tools",
-                "commission_range": (2, 6),
-                "platform": "SparkLoop",
-                "gravity_range": (35, 85)
-            },
-            {
-                "title": "Side Hustle Success Stories",
-                "description": "Weekly newsletter featuring real people making $1,000-$10,000+ monthly from side hustles. Includes actionable tips and strategies.",
-                "category": "make_money",
-                "commission_range": (4, 8),
-                "platform": "SparkLoop",
-                "gravity_range": (45, 90)
-            },
-            
-            # beehiiv Newsletter Offers
-            {
-                "title": "The Entrepreneur's Edge",
-                "description": "Daily newsletter with business insights from top entrepreneurs. Join 75,000+ subscribers getting exclusive content.",
-                "category": "newsletters",
-                "commission_range": (2, 5),
-                "platform": "beehiiv",
-                "gravity_range": (50, 95)
-            },
-            {
-                "title": "Tech Trends Weekly",
-                "description": "Weekly roundup of the hottest tech trends, gadgets, and innovations. Perfect for tech enthusiasts and early adopters.",
-                "category": "gadgets",
-                "commission_range": (1.5, 4),
-                "platform": "beehiiv",
-                "gravity_range": (30, 80)
-            },
-            {
-                "title": "Morning Crypto Brief",
-                "description": "Daily crypto market analysis and opportunities. Get the edge with insider insights and market predictions.",
-                "category": "crypto_airdrops",
-                "commission_range": (3, 6),
-                "platform": "beehiiv",
-                "gravity_range": (40, 85)
-            }
-        ]
-        
         for i in range(count):
-            template = random.choice(offer_templates)
+            template, title_variations = random.choice(self._OFFER_POOL)
             commission = random.uniform(*template["commission_range"])
             gravity = random.uniform(*template["gravity_range"])
             
-            # Add some variation to titles
-            title_variations = [
-                template["title"],
-                f"{template['title']} - Limited Time",
-                f"🔥 {template['title']}",
-                f"{template['title']} 2025 Edition"
-            ]
-            
             offer = Offer(
                 title=random.choice(title_variations),
                 description=template["description"],
@@ -516,7 +630,13 @@ class OfferGenerator:
 class ContentGenerator:
     """Generate engaging content for posts"""
     
+    POST_CACHE_SIZE = 256
+    
     def __init__(self):
+        # Offer-derived post text keyed by offer id; the hook, CTA and urgency line are
+        # still picked per post so reposts of an offer don't read identically
+        self._post_cache: "OrderedDict[int, Tuple[str, str]]" = OrderedDict()
+        
         self.emojis = {
             "make_money": ["💰", "💵", "🤑", "💸", "🏆", "💎", "🚀"],
             "ai_tools": ["🤖", "⚡", "🚀", "💡", "🔥", "⭐", "🎯"],
@@ -544,22 +664,8 @@ class ContentGenerator:
             "🚀 START EARNING TODAY - CLICK",
             "💎 EXCLUSIVE ACCESS - TAP HERE"
         ]
-    
-    def generate_post(self, offer: Offer) -> str:
-        """Generate engaging post content"""
-        category_emojis = self.emojis.get(offer.category, ["🔥"])
-        emoji = random.choice(category_emojis)
-        hook = random.choice(self.hooks)
-        cta = random.choice(self.ctas)
         
-        # Platform-specific formatting
-        if offer.platform in ["SparkLoop", "beehiiv"]:
-            commission_text = f"💵 **Earn**: ${offer.commission:.2f} per subscriber"
-        else:
-            commission_text = f"💵 **Commission**: ${offer.commission:.2f}"
-        
-        # Category-specific descriptions
-        urgency_phrases = [
+        self.urgency_phrases = [
             "⏰ *Limited time offer - Act fast!*",
             "🔥 *Trending now - Don't miss out!*",
             "⚡ *High demand - Secure your spot!*",
@@ -567,98 +673,65 @@ class ContentGenerator:
             "🚀 *Viral opportunity - Join now!*"
         ]
         
-        post = f"{emoji} **{hook}** {emoji}\n\n"
-        post += f"🎯 **{offer.title}**\n\n"
-        post += f"{commission_text}\n"
-        post += f"⭐ **Platform**: {offer.platform}\n"
-        post += f"📈 **Category**: {offer.category.replace('_', ' ').title()}\n"
-        
-        if offer.gravity:
-            post += f"🔥 **Popularity**: {offer.gravity:.0f}/100\n"
-        
-        post += f"\n{offer.description}\n\n"
-        post += f"{cta}\n"
-        post += f"🔗 {offer.affiliate_link}\n\n"
-        post += random.choice(urgency_phrases)
-        
-        return post
-
-class TrendBot:
-    """Main TrendBot class - Cloud Compatible"""
+        # Precomputed per-category display labels, e.g. "ai_tools" -> "Ai Tools"
+        self._category_labels = {category: category.replace('_', ' ').title() for category in self.emojis}
+        self._per_subscriber_platforms = frozenset(["SparkLoop", "beehiiv"])
     
-    def __init__(self):
-        self.db = Database()
-        self.offer_generator = OfferGenerator()
-        self.content_generator = ContentGenerator()
-        self.app = None
-        self.stats = {
-            "posts_sent": 0,
-            "offers_generated": 0,
-            "bot_started": datetime.now()
-        }
+    def generate_post(self, offer: Offer) -> str:
+        """Generate engaging post content with a freshly picked hook, CTA and urgency line"""
+        category_emojis = self.emojis.get(offer.category, ["🔥"])
+        emoji = random.choice(category_emojis)
+        hook = random.choice(self.hooks)
+        cta = random.choice(self.ctas)
+        details, link_line = self._offer_details(offer)
+        
+        return (
+            f"{emoji} **{hook}** {emoji}\n\n"
+            f"{details}"
+            f"{cta}\n"
+            f"{link_line}"
+            f"{random.choice(self.urgency_phrases)}"
+        )
     
-    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /start command with referral tracking"""
-        user = update.effective_user
-        
-        # Extract referral code from command args
-        referral_code = None
-        if context.args and len(context.args) > 0:
-            referral_code = context.args[0]
-        
-        # Get or create user
-        existing_user = self.db.get_user(user.id)
+    def _offer_details(self, offer: Offer) -> Tuple[str, str]:
+        """Return the offer-derived post text, cached for saved offers"""
+        if offer.id is None:
+            return self._render_offer_details(offer)
+        
+        details = self._post_cache.get(offer.id)
+        if details:
+            self._post_cache.move_to_end(offer.id)
+            return details
+        
+        details = self._post_cache[offer.id] = self._render_offer_details(offer)
+        if len(self._post_cache) > self.POST_CACHE_SIZE:
+            self._post_cache.popitem(last=False)
+        return details
+    
+    def _render_offer_details(self, offer: Offer) -> Tuple[str, str]:
+        """Render the offer block (title through description) and the link line"""
+        category_label = self._category_labels.get(offer.category) or offer.category.replace('_', ' ').title()
         
-        if not existing_user:
-            # Create new user
-            new_user = User(
-                user_id=user.id,
-                username=user.username or "",
-                first_name=user.first_name or "",
-                referred_by=referral_code
-            )
-            self.db.save_user(new_user)
-            
-            # Process referral if valid
-            if referral_code:
-                referrer = self.db.get_user_by_referral_code(referral_code)
-                if referrer:
-                    # Create referral record with reward
-                    reward_amount = 5.0  # $5 reward per referral
-                    referral = Referral(
-                        referrer_code=referral_code,
-                        referred_user_id=user.id,
-                        reward_amount=reward_amount,
-                        status="confirmed"
-                    )
-                    self.db.save_referral(referral)
-                    
-                    # Notify referrer
-                    try:
-                        await context.bot.send_message(
-                            chat_id=referrer.user_id,
-                            text=f"🎉 **New Referral!**\n\n"
-                                 f"💎 {user.first_name or user.username or 'Someone'} joined using your referral link!\n"
-                                 f"💰 You earned: ${reward_amount:.2f}\n"
-                                 f"📊 Total referrals: {referrer.referral_count + 1}\n\n"
-                                 f"Keep sharing to earn more! 🚀",
-                            parse_mode=ParseMode.MARKDOWN
-                        )
-                    except:
-                        pass  # User might have blocked the bot
-            
-            welcome_type = "new_with_referral" if referral_code else "new"
+        # Platform-specific formatting
+        if offer.platform in self._per_subscriber_platforms:
+            commission_text = f"💵 **Earn**: ${offer.commission:.2f} per subscriber"
         else:
-            # Update existing user activity
-            existing_user.last_active = datetime.now()
-            self.db.save_user(existing_user)
-            welcome_type = "returning"
-        
-        # Get user's current stats
-        current_user = self.db.get_user(user.id)
+            commission_text = f"💵 **Commission**: ${offer.commission:.2f}"
         
-        if welcome_type == "new_with_referral":
-            welcome_message = f"""
+        gravity_line = f"🔥 **Popularity**: {offer.gravity:.0f}/100\n" if offer.gravity else ""
+        
+        details = (
+            f"🎯 **{offer.title}**\n\n"
+            f"{commission_text}\n"
+            f"⭐ **Platform**: {offer.platform}\n"
+            f"📈 **Category**: {category_label}\n"
+            f"{gravity_line}"
+            f"\n{offer.description}\n\n"
+        )
+        return details, f"🔗 {offer.affiliate_link}\n\n"
+
+# Message templates, built once at import and filled per request with str.format
+WELCOME_REFERRED_TEMPLATE = """
 💎 **Welcome to LuxuryTrendBot!** 
 
 🎉 **You were referred by a VIP member!**
@@ -672,7 +745,7 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
 
 **🔥 REFERRAL PROGRAM:**
 💸 Earn $5 for each person you refer!
-🔗 Your referral link: https://t.me/LuxuryTrendBot?start={current_user.referral_code}
+🔗 Your referral link: https://t.me/LuxuryTrendBot?start={code}
 📊 Share and earn unlimited rewards!
 
 **Commands:**
@@ -684,9 +757,9 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
 🎯 *I automatically post premium opportunities every 4 hours!*
 
 💎 **Start earning luxury-level passive income today!**
-            """
-        elif welcome_type == "new":
-            welcome_message = f"""
+"""
+
+WELCOME_NEW_TEMPLATE = """
 💎 **Welcome to LuxuryTrendBot!**
 
 I'm your premium automated money opportunity finder. I discover the most exclusive and high-paying opportunities:
@@ -698,7 +771,7 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
 
 **🔥 REFERRAL PROGRAM:**
 💸 Earn $5 for each person you refer!
-🔗 Your referral link: https://t.me/LuxuryTrendBot?start={current_user.referral_code}
+🔗 Your referral link: https://t.me/LuxuryTrendBot?start={code}
 📊 Share and earn unlimited rewards!
 
 **Commands:**
@@ -710,15 +783,15 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
 🎯 *I automatically post premium opportunities every 4 hours!*
 
 💎 **Start earning luxury-level passive income today!**
-            """
-        else:  # returning user
-            welcome_message = f"""
+"""
+
+WELCOME_BACK_TEMPLATE = """
 💎 **Welcome back to LuxuryTrendBot!**
 
 **Your Referral Stats:**
-👥 Referrals: {current_user.referral_count}
-💰 Earnings: ${current_user.total_earnings:.2f}
-🔗 Your link: https://t.me/LuxuryTrendBot?start={current_user.referral_code}
+👥 Referrals: {referral_count}
+💰 Earnings: ${earnings:.2f}
+🔗 Your link: https://t.me/LuxuryTrendBot?start={code}
 
 **Quick Commands:**
 /referral - Referral dashboard
@@ -726,13 +799,39 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
 /help - All commands
 
 🎯 *Keep sharing to earn more rewards!*
-            """
-        
-        await update.message.reply_text(welcome_message, parse_mode=ParseMode.MARKDOWN)
-    
-    async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /help command"""
-        help_message = """
+"""
+
+REFERRAL_TEMPLATE = """
+💎 **Your Referral Dashboard**
+
+**📊 Your Stats:**
+👥 **Total Referrals**: {referral_count}
+💰 **Total Earnings**: ${earnings:.2f}
+🏆 **Referral Code**: {code}
+
+**🔗 Your Referral Link:**
+`https://t.me/LuxuryTrendBot?start={code}`
+
+**💸 How It Works:**
+• Share your link with friends
+• Earn $5 for each person who joins
+• No limits - unlimited earning potential!
+• Instant rewards when someone joins
+
+**🚀 Sharing Tips:**
+• Post in social media groups
+• Share with entrepreneur friends
+• Add to your email signature
+• Include in your content
+
+**Recent Referrals:**
+{recent}
+💎 **Keep sharing to climb the leaderboard!**"""
+
+# Leaderboard rank labels: medals for the top three, then "4.", "5.", ...
+RANK_PREFIXES = ("🥇", "🥈", "🥉", *(f"{rank}." for rank in range(4, LEADERBOARD_LIMIT + 1)))
+
+HELP_MESSAGE = """
 💎 **LuxuryTrendBot Help**
 
 **🔥 REFERRAL COMMANDS:**
@@ -775,12 +874,116 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
 💎 *Bot runs 24/7 to maximize your luxury earning potential!*
 
 🚀 **Use /referral to start earning immediately!**
-        """
-        await update.message.reply_text(help_message, parse_mode=ParseMode.MARKDOWN)
+"""
+
+class TrendBot:
+    """Main TrendBot class - Cloud Compatible"""
+    
+    STATS_CACHE_TTL = 60.0  # seconds
+    
+    def __init__(self):
+        self.db = Database()
+        self.offer_generator = OfferGenerator()
+        self.content_generator = ContentGenerator()
+        self.app = None
+        # Single worker keeps every SQLite call on one thread, in submission order
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trendbot-db")
+        # Rendered /stats message and when it was built; reset when offers change
+        self._stats_cache: Optional[Tuple[float, str]] = None
+        self.stats = {
+            "posts_sent": 0,
+            "offers_generated": 0,
+            "bot_started": datetime.now()
+        }
+    
+    async def _run_db(self, func, *args):
+        """Run a blocking database call on the database thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, func, *args)
+    
+    def _register_start(self, user, referral_code: Optional[str]) -> Tuple[User, str, Optional[User]]:
+        """Create or refresh the user behind a /start; runs on the database thread"""
+        referrer = None
+        
+        # Get or create user
+        existing_user = self.db.get_user(user.id)
+        
+        if not existing_user:
+            # Create new user
+            new_user = User(
+                user_id=user.id,
+                username=user.username or "",
+                first_name=user.first_name or "",
+                referred_by=referral_code
+            )
+            self.db.save_user(new_user)
+            
+            # Process referral if valid
+            if referral_code:
+                referrer = self.db.get_user_by_referral_code(referral_code)
+                if referrer:
+                    # Create referral record with reward
+                    referral = Referral(
+                        referrer_code=referral_code,
+                        referred_user_id=user.id,
+                        reward_amount=REFERRAL_REWARD,
+                        status="confirmed"
+                    )
+                    self.db.save_referral(referral, referrer.id)
+            
+            welcome_type = "new_with_referral" if referral_code else "new"
+        else:
+            # Update existing user activity (last_active is set by the database)
+            self.db.save_user(existing_user)
+            welcome_type = "returning"
+        
+        # Get user's current stats
+        return self.db.get_user(user.id), welcome_type, referrer
+    
+    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /start command with referral tracking"""
+        user = update.effective_user
+        
+        # Extract referral code from command args
+        referral_code = None
+        if context.args and len(context.args) > 0:
+            referral_code = context.args[0]
+        
+        current_user, welcome_type, referrer = await self._run_db(self._register_start, user, referral_code)
+        
+        # Notify referrer (they might have blocked the bot); cancellation still propagates
+        if referrer:
+            with suppress(TelegramError):
+                await context.bot.send_message(
+                    chat_id=referrer.user_id,
+                    text=f"🎉 **New Referral!**\n\n"
+                         f"💎 {user.first_name or user.username or 'Someone'} joined using your referral link!\n"
+                         f"💰 You earned: ${REFERRAL_REWARD:.2f}\n"
+                         f"📊 Total referrals: {referrer.referral_count + 1}\n\n"
+                         f"Keep sharing to earn more! 🚀",
+                    parse_mode=ParseMode.MARKDOWN
+                )
+        
+        if welcome_type == "new_with_referral":
+            welcome_message = WELCOME_REFERRED_TEMPLATE.format(code=current_user.referral_code)
+        elif welcome_type == "new":
+            welcome_message = WELCOME_NEW_TEMPLATE.format(code=current_user.referral_code)
+        else:  # returning user
+            welcome_message = WELCOME_BACK_TEMPLATE.format(
+                referral_count=current_user.referral_count,
+                earnings=current_user.total_earnings,
+                code=current_user.referral_code
+            )
+        
+        await update.message.reply_text(welcome_message, parse_mode=ParseMode.MARKDOWN)
+    
+    async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /help command"""
+        await update.message.reply_text(HELP_MESSAGE, parse_mode=ParseMode.MARKDOWN)
     
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /status command"""
-        offers_count = len(self.db.get_offers(limit=1000))
+        offers_count, posts_count, users_count, referrals_count = await self._run_db(self.db.stats)
         uptime = datetime.now() - self.stats["bot_started"]
         
         status_message = f"""
@@ -789,6 +992,7 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
 🤖 **Bot**: Online and running
 📊 **Database**: Connected
 💾 **Offers Loaded**: {offers_count}
+👥 **Users**: {users_count} ({referrals_count} referrals)
 🔄 **Auto-posting**: Every 4 hours
 📢 **Channel**: {TELEGRAM_CHANNEL_ID}
 ⏰ **Uptime**: {str(uptime).split('.')[0]}
@@ -796,6 +1000,7 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
 **Performance:**
 • Posts sent: {self.stats['posts_sent']}
 • Offers generated: {self.stats['offers_generated']}
+• Posts logged (all time): {posts_count}
 
 **Last Update**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
@@ -805,41 +1010,33 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
     
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /stats command"""
-        offers = self.db.get_offers(limit=1000)
-        
-        if not offers:
-            await update.message.reply_text("📊 No statistics available yet. Generating offers...")
+        if self._stats_cache and time.monotonic() - self._stats_cache[0] < self.STATS_CACHE_TTL:
+            await update.message.reply_text(self._stats_cache[1], parse_mode=ParseMode.MARKDOWN)
             return
         
-        avg_commission = sum(offer.commission for offer in offers) / len(offers)
-        platforms = {}
-        categories = {}
+        (offers_count, avg_commission, platforms, categories,
+         top_platform, top_category) = await self._run_db(self.db.get_offer_stats)
         
-        for offer in offers:
-            platforms[offer.platform] = platforms.get(offer.platform, 0) + 1
-            categories[offer.category] = categories.get(offer.category, 0) + 1
+        if not offers_count:
+            await update.message.reply_text("📊 No statistics available yet. Generating offers...")
+            return
         
-        stats_message = f"""
+        parts = [f"""
 📊 **TrendBot Statistics**
 
-💰 **Total Offers**: {len(offers)}
+💰 **Total Offers**: {offers_count}
 💵 **Average Commission**: ${avg_commission:.2f}
-🏆 **Top Platform**: {max(platforms, key=platforms.get)}
-🎯 **Top Category**: {max(categories, key=categories.get)}
+🏆 **Top Platform**: {top_platform}
+🎯 **Top Category**: {top_category}
 
-**Platform Breakdown:**
-"""
-        for platform, count in platforms.items():
-            stats_message += f"• {platform}: {count} offers\n"
-        
-        stats_message += f"""
-**Category Breakdown:**
-"""
-        for category, count in categories.items():
-            stats_message += f"• {category.replace('_', ' ').title()}: {count} offers\n"
-        
-        stats_message += f"\n**Revenue Potential**: ${avg_commission * len(offers):.2f}"
-        stats_message += f"\n**Monthly Projection**: ${avg_commission * 30:.2f} (1 conversion/day)"
+**Platform Breakdown:**"""]
+        parts.extend(f"• {platform}: {count} offers" for platform, count in platforms)
+        parts.append("\n**Category Breakdown:**")
+        parts.extend(f"• {category.replace('_', ' ').title()}: {count} offers" for category, count in categories)
+        parts.append(f"\n**Revenue Potential**: ${avg_commission * offers_count:.2f}")
+        parts.append(f"**Monthly Projection**: ${avg_commission * 30:.2f} (1 conversion/day)")
+        stats_message = "\n".join(parts)
+        self._stats_cache = (time.monotonic(), stats_message)
         
         await update.message.reply_text(stats_message, parse_mode=ParseMode.MARKDOWN)
     
@@ -851,10 +1048,8 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
         except Exception as e:
             await update.message.reply_text(f"❌ Failed to send post: {str(e)}")
     
-    async def referral_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /referral command - show referral dashboard"""
-        user = update.effective_user
-        
+    def _load_referral_dashboard(self, user) -> Tuple[User, List[Referral]]:
+        """Fetch (creating if needed) a user and their referrals; runs on the database thread"""
         # Get or create user
         db_user = self.db.get_user(user.id)
         if not db_user:
@@ -863,52 +1058,39 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
                 username=user.username or "",
                 first_name=user.first_name or ""
             )
-            self.db.save_user(new_user)
-            db_user = self.db.get_user(user.id)
-        
-        # Get referral stats
-        referrals = self.db.get_referrals(db_user.referral_code)
+            # A fresh row has zero referrals and earnings, exactly what new_user holds
+            new_user.id = self.db.save_user(new_user)
+            db_user = new_user
         
-        referral_message = f"""
-💎 **Your Referral Dashboard**
-
-**📊 Your Stats:**
-👥 **Total Referrals**: {db_user.referral_count}
-💰 **Total Earnings**: ${db_user.total_earnings:.2f}
-🏆 **Referral Code**: {db_user.referral_code}
-
-**🔗 Your Referral Link:**
-`https://t.me/LuxuryTrendBot?start={db_user.referral_code}`
-
-**💸 How It Works:**
-• Share your link with friends
-• Earn $5 for each person who joins
-• No limits - unlimited earning potential!
-• Instant rewards when someone joins
-
-**🚀 Sharing Tips:**
-• Post in social media groups
-• Share with entrepreneur friends
-• Add to your email signature
-• Include in your content
-
-**Recent Referrals:**
-"""
+        # Get the most recent referrals shown on the dashboard
+        return db_user, self.db.get_referrals(db_user.referral_code, limit=5)
+    
+    async def referral_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /referral command - show referral dashboard"""
+        user = update.effective_user
+        db_user, referrals = await self._run_db(self._load_referral_dashboard, user)
         
         if referrals:
-            for i, referral in enumerate(referrals[:5]):  # Show last 5
+            recent_lines = []
+            for referral in referrals:
                 status_emoji = "✅" if referral.status == "confirmed" else "⏳"
-                referral_message += f"{status_emoji} ${referral.reward_amount:.2f} - {referral.created_at.strftime('%m/%d')}\n"
+                created = referral.created_at
+                recent_lines.append(f"{status_emoji} ${referral.reward_amount:.2f} - {created.month:02d}/{created.day:02d}\n")
+            recent = "".join(recent_lines)
         else:
-            referral_message += "No referrals yet. Start sharing your link! 🚀"
-        
-        referral_message += f"\n💎 **Keep sharing to climb the leaderboard!**"
-        
+            recent = "No referrals yet. Start sharing your link! 🚀"
+        
+        referral_message = REFERRAL_TEMPLATE.format(
+            referral_count=db_user.referral_count,
+            earnings=db_user.total_earnings,
+            code=db_user.referral_code,
+            recent=recent
+        )
         await update.message.reply_text(referral_message, parse_mode=ParseMode.MARKDOWN)
     
     async def leaderboard_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /leaderboard command - show top referrers"""
-        leaderboard = self.db.get_leaderboard(10)
+        leaderboard = await self._run_db(self.db.get_leaderboard, LEADERBOARD_LIMIT)
         
         if not leaderboard:
             await update.message.reply_text(
@@ -918,35 +1100,30 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
             )
             return
         
-        leaderboard_message = "🏆 **Top Referrers - Leaderboard**\n\n"
+        parts = ["🏆 **Top Referrers - Leaderboard**\n"]
+        parts.extend(
+            f"{RANK_PREFIXES[i]} **{user.first_name or user.username or 'Anonymous'}**\n"
+            f"   👥 {user.referral_count} referrals | 💰 ${user.total_earnings:.2f}\n"
+            for i, user in enumerate(leaderboard)
+        )
+        parts.append("💎 **Want to be on the leaderboard?**")
+        parts.append("Use /referral to get your link and start earning! 🚀")
         
-        medals = ["🥇", "🥈", "🥉"]
-        for i, user in enumerate(leaderboard):
-            medal = medals[i] if i < 3 else f"{i+1}."
-            name = user.first_name or user.username or "Anonymous"
-            leaderboard_message += f"{medal} **{name}**\n"
-            leaderboard_message += f"   👥 {user.referral_count} referrals | 💰 ${user.total_earnings:.2f}\n\n"
-        
-        leaderboard_message += "💎 **Want to be on the leaderboard?**\n"
-        leaderboard_message += "Use /referral to get your link and start earning! 🚀"
-        
-        await update.message.reply_text(leaderboard_message, parse_mode=ParseMode.MARKDOWN)
+        await update.message.reply_text("\n".join(parts), parse_mode=ParseMode.MARKDOWN)
     
     async def post_to_channel(self):
         """Post offer to channel"""
         try:
-            # Get or generate offers
-            offers = self.db.get_offers(limit=10)
-            if not offers:
+            # Select a random offer, generating new ones if there are none
+            pick_offer = self.db.get_weighted_offer if WEIGHTED_OFFER_SELECTION else self.db.get_random_offer
+            offer = await self._run_db(pick_offer)
+            if not offer:
                 log.info("No offers found, generating new ones...")
                 new_offers = self.offer_generator.generate_offers(20)
-                for offer in new_offers:
-                    self.db.save_offer(offer)
-                    self.stats["offers_generated"] += 1
-                offers = new_offers[:10]
-            
-            # Select random offer
-            offer = random.choice(offers)
+                await self._run_db(self.db.save_offers, new_offers)
+                self.stats["offers_generated"] += len(new_offers)
+                self._stats_cache = None
+                offer = await self._run_db(pick_offer)
             
             # Generate post content
             post_content = self.content_generator.generate_post(offer)
@@ -959,7 +1136,7 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
             )
             
             # Log the post
-            self.db.log_post(offer.id, TELEGRAM_CHANNEL_ID, message.message_id)
+            await self._run_db(self.db.log_post, offer.id, TELEGRAM_CHANNEL_ID, message.message_id)
             self.stats["posts_sent"] += 1
             
             log.info(f"✅ Posted offer to channel: {offer.title} (Commission: ${offer.commission:.2f})")
@@ -987,13 +1164,12 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
         log.info("=" * 50)
         
         # Initialize offers
-        offers = self.db.get_offers(limit=1)
-        if not offers:
+        if not self.db.has_offers():
             log.info("📦 Generating initial offers...")
             initial_offers = self.offer_generator.generate_offers(30)
-            for offer in initial_offers:
-                self.db.save_offer(offer)
-                self.stats["offers_generated"] += 1
+            self.db.save_offers(initial_offers)
+            self.stats["offers_generated"] += len(initial_offers)
+            self._stats_cache = None
             log.info(f"✅ Generated {len(initial_offers)} initial offers")
         
         # Create application
@@ -1020,6 +1196,9 @@ I'm your premium automated money opportunity finder. I discover the most exclusi
         
         # Start polling - cloud compatible
         self.app.run_polling(drop_pending_updates=True)
+        
+        self._db_executor.shutdown(wait=True)
+        self.db.close()
 
 def main():
     """Main entry point - cloud compatible"""
@@ -5,17 +5,18 @@ Test script for LuxuryTrendBot referral system
 
 import sys
 import os
+import random
 sys.path.append('.')
 
-from main_standalone import Database, User, Referral
+from main_standalone import Database, Offer, User, Referral
 
 def test_referral_system():
     """Test the referral system functionality"""
     print('🧪 Testing LuxuryTrendBot Referral System...')
     
     try:
-        # Initialize database
-        db = Database('test_referral.db')
+        # Initialize an in-memory database (no file, no fsync)
+        db = Database(':memory:')
         print('✅ Database initialized')
         
         # Create test users
@@ -23,7 +24,7 @@ def test_referral_system():
         user2 = User(user_id=67890, username='testuser2', first_name='Bob', referred_by=user1.referral_code)
         
         # Save users
-        db.save_user(user1)
+        user1_id = db.save_user(user1)
         db.save_user(user2)
         print('✅ Test users created')
         print(f'   User 1 referral code: {user1.referral_code}')
@@ -36,7 +37,7 @@ def test_referral_system():
             reward_amount=5.0,
             status='confirmed'
         )
-        db.save_referral(referral)
+        db.save_referral(referral, user1_id)
         print('✅ Referral created')
         
         # Test retrieval
@@ -64,6 +65,41 @@ def test_referral_system():
         traceback.print_exc()
         return False
 
-if __name__ == "__main__":
-    test_referral_system()
+def test_weighted_offer_selection():
+    """Test commission-weighted offer selection"""
+    print('🧪 Testing weighted offer selection...')
+    
+    db = Database(':memory:')
+    random.seed(1234)
+    
+    # Zero and negative commissions carry no weight
+    db.save_offers([
+        Offer(title='Free', commission=0.0),
+        Offer(title='Refund', commission=-5.0),
+        Offer(title='Big', commission=30.0),
+        Offer(title='Small', commission=10.0),
+    ])
+    picks = [db.get_weighted_offer().title for _ in range(400)]
+    assert set(picks) == {'Big', 'Small'}, set(picks)
+    assert 2 < picks.count('Big') / picks.count('Small') < 4.5
+    print(f'✅ Weighted picks: Big={picks.count("Big")}, Small={picks.count("Small")}')
+    
+    # Saving offers rebuilds the cumulative weights
+    db.save_offers([Offer(title='Huge', commission=10000.0)])
+    picks = [db.get_weighted_offer().title for _ in range(50)]
+    assert picks.count('Huge') > 45, picks
+    print('✅ Weights rebuilt after save_offers')
+    
+    # An all-zero pool falls back to a uniform pick
+    db = Database(':memory:')
+    assert db.get_weighted_offer() is None
+    db.save_offers([Offer(title='A', commission=0.0), Offer(title='B', commission=None)])
+    assert db.get_weighted_offer().title in {'A', 'B'}
+    print('✅ Uniform fallback for zero commissions')
+    
+    print('🎉 All weighted offer selection tests passed!')
+    return True
 
+if __name__ == "__main__":
+    results = [test_referral_system(), test_weighted_offer_selection()]
+    sys.exit(0 if all(results) else 1)